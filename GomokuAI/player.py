@@ -13,7 +13,9 @@ import math
 import copy
 from gomokuAgent import GomokuAgent
 import time
-from misc import winningTest
+from misc import threatScore, LiveWindows, windowTable
+from symmetry import uniqueMoves, SymmetricHash
+from endgame import solveEndgame
 from random import choice
 
 class Node:
@@ -21,36 +23,174 @@ class Node:
     '''
     Initializing the node with the necessary attributes for the Node class
     '''
-    def __init__(self, board, parent, current_player, move_loc):
+    def __init__(self, board, parent, current_player, move_loc, prior=0.0):
         self.board = board # The current game state of the board
         self.parent = parent # Parent node
         self.current_player = current_player # The current player
         self.move_loc = move_loc # The move location
+        self.prior = prior # Prior probability of the move, from the threat heuristic
         # Initializing the node with an empty list of children
         self.children = []
+        # Moves not yet added as children, as (prior, move) pairs in descending prior order
+        self.candidates = []
         # Initializing the number of times the nodes has been visited and the number of wins 
         self.visits = 0
         self.wins = 0
+        # All-moves-as-first (AMAF) statistics: playouts in which this node's move was played
+        # by the same player at any later point, and how many of those were won
+        self.amaf_visits = 0
+        self.amaf_wins = 0
         # Initialize a flag indicating whether the node has been expanded yet or not
         self.expanded = False
+        # Threat map and live windows of the board, only built for the root and copied into each rollout
+        self.threats = None
+        self.live = None
 
     '''
-    Create child nodes for the current node 
+    Score every legal move once with the threat heuristic and queue them as candidates.
+    Children are only created later, a few at a time, by widen.
+    Parameters:
+        - x_in_a_line: Number of stones in a row required to win the game
     '''
-    def expand(self):
+    def expand(self, x_in_a_line):
         # Create a list of all legal moves that can be made by the current player
         legal_moves = [(i, j) for i in range(len(self.board)) for j in range(len(self.board)) if self.board[i][j] == 0]
+        # A position where neither player can still complete a line is a draw, so it has no moves worth searching.
+        # The root keeps its moves, as the player still has to return one
+        if self.parent is not None and LiveWindows(self.board, x_in_a_line).isDead():
+            legal_moves = []
 
-        # Create a new board for each legal move by making that move and add it as a child node to the current node
-        for move in legal_moves:
-            new_board = copy.deepcopy(self.board)
-            new_board[move[0]][move[1]] = self.current_player
-            new_node = Node(new_board, self, -self.current_player, move)
-            self.children.append(new_node)
+        # Turn the heuristic scores into priors, the +1 keeps moves next to nothing possible
+        scores = [threatScore(self.board, move, self.current_player, x_in_a_line) + 1 for move in legal_moves]
+        total = sum(scores)
+        self.candidates = sorted(((score / total, move) for score, move in zip(scores, legal_moves)), reverse=True)
 
         # Mark the current node as expanded so that its does not get expanded again in the future
         self.expanded = True
 
+    '''
+    Create child nodes for the highest prior candidates until the node has limit children
+    Parameters:
+        - limit: The number of children the node may have
+    Returns:
+        - added: The number of child nodes created
+    '''
+    def widen(self, limit):
+        added = 0
+        while len(self.children) < limit and self.candidates:
+            prior, move = self.candidates.pop(0)
+            self.add_child(move, prior)
+            added += 1
+        return added
+
+    '''
+    Create the child node for a candidate move straight away, whatever its prior
+    Parameters:
+        - move: The move to add
+    Returns:
+        - added: 1 if a child node was created, 0 if the move is not a candidate
+    '''
+    def promote(self, move):
+        for i, (prior, candidate) in enumerate(self.candidates):
+            if candidate == move:
+                del self.candidates[i]
+                self.add_child(move, prior)
+                return 1
+        return 0
+
+    def add_child(self, move, prior):
+        # Create a new board for the move by making that move and add it as a child node to the current node
+        new_board = copy.deepcopy(self.board)
+        new_board[move[0]][move[1]] = self.current_player
+        self.children.append(Node(new_board, self, -self.current_player, move, prior))
+
+class ThreatMap:
+
+    '''
+    Rollout board that keeps, for each player, the set of empty cells where playing would
+    complete X_IN_A_LINE in a row. Placing a stone can only add the cells at the two ends of
+    the player's runs through it, so each move rescans those cells in O(X_IN_A_LINE) instead
+    of rescanning the board. Building the map scans the whole board, so it is built once per
+    search and copied.
+    '''
+    DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+    def __init__(self, board, x_in_a_line):
+        self.board_size = len(board)
+        self.x_in_a_line = x_in_a_line
+        self.board = [[int(cell) for cell in row] for row in board]
+        # Empty cells, in a list for O(1) random choice, with each cell's position in the list
+        self.empty = [(r, c) for r in range(self.board_size) for c in range(self.board_size) if self.board[r][c] == 0]
+        self.index = {cell: i for i, cell in enumerate(self.empty)}
+        # Cells where the player would complete X_IN_A_LINE in a row
+        self.wins = {1: set(), -1: set()}
+        for cell in self.empty:
+            for player in (1, -1):
+                if any(self.line_length(cell, d, player) >= x_in_a_line for d in range(4)):
+                    self.wins[player].add(cell)
+
+    def copy(self):
+        other = ThreatMap.__new__(ThreatMap)
+        other.board_size = self.board_size
+        other.x_in_a_line = self.x_in_a_line
+        other.board = [list(row) for row in self.board]
+        other.empty = list(self.empty)
+        other.index = dict(self.index)
+        other.wins = {1: set(self.wins[1]), -1: set(self.wins[-1])}
+        return other
+
+    '''
+    Returns the length of the line player would make at the empty cell in direction d, up to X_IN_A_LINE
+    '''
+    def line_length(self, cell, d, player):
+        dr, dc = self.DIRECTIONS[d]
+        length = 1
+        for sign in (1, -1):
+            r, c = cell[0] + sign * dr, cell[1] + sign * dc
+            while (0 <= r < self.board_size and 0 <= c < self.board_size and
+                    self.board[r][c] == player and length < self.x_in_a_line):
+                length += 1
+                r, c = r + sign * dr, c + sign * dc
+        return length
+
+    '''
+    Returns a random cell where player would complete a line, or None
+    '''
+    def winning_move(self, player):
+        if not self.wins[player]:
+            return None
+        return choice(tuple(self.wins[player]))
+
+    def completes_line(self, cell, player):
+        return cell in self.wins[player]
+
+    '''
+    Places a stone for player at the empty cell and updates the cells at the ends of its runs
+    '''
+    def place(self, cell, player):
+        r0, c0 = cell
+        self.board[r0][c0] = player
+        # Remove the cell from the empty list by swapping in the last cell
+        i = self.index.pop(cell)
+        last = self.empty.pop()
+        if last != cell:
+            self.empty[i] = last
+            self.index[last] = i
+        for p in (1, -1):
+            self.wins[p].discard(cell)
+
+        # Only the player's lines through the stone grow; the opponent's lines never ran through an empty cell
+        for d, (dr, dc) in enumerate(self.DIRECTIONS):
+            for sign in (1, -1):
+                r, c = r0 + sign * dr, c0 + sign * dc
+                steps = 1
+                while 0 <= r < self.board_size and 0 <= c < self.board_size and self.board[r][c] == player and steps < self.x_in_a_line:
+                    r, c = r + sign * dr, c + sign * dc
+                    steps += 1
+                if 0 <= r < self.board_size and 0 <= c < self.board_size and self.board[r][c] == 0:
+                    if self.line_length((r, c), d, player) >= self.x_in_a_line:
+                        self.wins[player].add((r, c))
+
 class Player(GomokuAgent):
     '''
     Initializing the node with the necessary attributes for the Player class
@@ -60,6 +200,30 @@ class Player(GomokuAgent):
         self.board_size = BOARD_SIZE # Size of the game board
         self.x_in_a_line = X_IN_A_LINE # Number of stones in a row required to win the game
         self.TIME_OUT = 5 # The amount of time the player has to make a move
+        self.SYMMETRY_STONES = 4 # Merge symmetric root children while the board has at most this many stones
+        self.ENDGAME_EMPTY = 10 # Solve the position exactly instead of searching once this few cells are empty
+        self.endgame_memo = {} # Positions solved by the endgame solver, kept between moves
+        self.MAX_PLAYOUTS = None # Optional cap on playouts per move, used for fixed-effort analysis
+        self.RAVE_K = 300 # Visits at which RAVE and UCB1 estimates are weighted equally, 0 disables RAVE
+        self.PUCT_C = 1.0 # Weight of the prior term in child selection
+        # Progressive widening: a node with n visits may have WIDEN_BASE + WIDEN_FACTOR * n ** WIDEN_EXPONENT children
+        self.WIDEN_BASE = 4
+        self.WIDEN_FACTOR = 1.0
+        self.WIDEN_EXPONENT = 0.5
+        # Node budget for the search tree, None for no limit. Once it is reached the least visited
+        # subtrees are pruned until the tree is back down to PRUNE_FRACTION of the budget
+        self.MAX_NODES = 20000
+        self.PRUNE_FRACTION = 0.75
+        self.tree_size = 0 # Number of nodes in the current search tree
+        self.peak_tree_size = 0 # Largest search tree this player has built
+
+    '''
+    Builds the window and symmetry tables for this board size once, before the first move,
+    so that their cost is not charged to the first move's time.
+    '''
+    def prepare(self):
+        windowTable(self.board_size, self.x_in_a_line)
+        SymmetricHash(self.board_size)
 
     '''
     The purpose of this method is to use monte carlo tree search to find
@@ -70,29 +234,78 @@ class Player(GomokuAgent):
         - best_child.mov_loc: The child node with the highest win rate
     '''
     def move(self, board):
+        # Near the end of the game an exact answer is cheaper than random playouts
+        if sum(1 for row in board for cell in row if cell == 0) <= self.ENDGAME_EMPTY:
+            move, result = solveEndgame(board, self.ID, self.x_in_a_line, self.endgame_memo)
+            # Report a proven win, draw or loss as a win rate of 1, 0.5 or 0
+            self.last_score = (result + 1) / 2
+            return move
+
+        # Once neither player can complete a line every move draws, so there is nothing to search
+        if LiveWindows(board, self.x_in_a_line).isDead():
+            self.last_score = 0.5
+            return next((r, c) for r in range(self.board_size) for c in range(self.board_size) if board[r][c] == 0)
+
+        root = self.search(board)
+
+        # Select a child node with the highest win rate after the search is complete.
+        best_child = self.select_best_child(root)
+        # Keep the win rate of the chosen move so tools such as self-play can record the search score
+        self.last_score = best_child.wins / best_child.visits if best_child.visits else 0.0
+        return best_child.move_loc
+
+    '''
+    Runs monte carlo tree search from the given board until TIME_OUT seconds have passed
+    or, if MAX_PLAYOUTS is set, that many playouts have been made.
+    Parameters:
+        - board: The current state of the board
+        - root_moves: Moves that are made root children from the start, whatever their prior,
+          so that they are searched. A move merged away by symmetry is replaced by the kept move
+          that leads to the same position.
+    Returns:
+        - root: The root node of the search tree
+    '''
+    def search(self, board, root_moves=()):
         # Get the current time and the time at which the search should end
         start_time = time.time()
         end_time = start_time + self.TIME_OUT
+        playouts = 0
 
         root = Node(board, None, self.ID, None)
+        self.tree_size = 1
+        # Expand the root straight away so that symmetric moves can be merged before the search starts
+        root.expand(self.x_in_a_line)
+        self.merge_symmetric_children(root)
+        self.grow(root)
+        for move in root_moves:
+            self.tree_size += root.promote(self.symmetric_root_move(root, move))
 
-        # Loop until time runs out
-        while time.time() < end_time:
+        # Loop until time runs out, or the playout limit is reached
+        while time.time() < end_time and (self.MAX_PLAYOUTS is None or playouts < self.MAX_PLAYOUTS):
+            playouts += 1
+            # Free up the least visited parts of the tree once the node budget has been used
+            if self.MAX_NODES is not None and self.tree_size >= self.MAX_NODES:
+                self.prune_tree(root)
             # Starting at the root
             node = root
             # selection
             while node.children:
-                # Select the child with the highest UCB1 score
+                # Add children as the node's visit count grows, then select the best scoring one
+                self.grow(node)
                 node = self.select_child(node)
 
             # expansion
-            # If the selected node is not expanded yet, generate all possible child nodes
-            if not node.expanded:
-                node.expand()
+            # If the selected node has been visited before but is not expanded yet, score its moves and
+            # create its first children. Fresh nodes are simulated once first, which halves the scoring work
+            if not node.expanded and node.visits:
+                node.expand(self.x_in_a_line)
+                self.grow(node)
 
             # simulation
-            # Simulate a game from the selected child node until the end of the game
-            winner = self.simulate(node)
+            # Simulate a game from the selected child node until the end of the game,
+            # recording every (move, player) pair made during the playout
+            played = set()
+            winner = self.simulate(node, played)
 
             # backpropagation
             # Update the statitics of all nodes visited during the search based on the result of the simulated game.
@@ -100,14 +313,132 @@ class Player(GomokuAgent):
                 node.visits += 1
                 if winner == self.ID:
                     node.wins += 1
+                self.update_amaf(node, played, winner)
+                # The move leading to this node was also played after its parent
+                if node.move_loc is not None:
+                    played.add((node.move_loc, -node.current_player))
                 node = node.parent
 
-        # Select a child node with the highest win rate after the search is complete.
-        best_child = self.select_best_child(root)
-        return best_child.move_loc
+        return root
+
+    '''
+    Removes root children whose resulting positions are rotations or reflections of an
+    earlier child, so the search does not split its playouts between identical positions.
+    Only applied on an empty or near-empty board, where such symmetries actually occur.
+    Parameters:
+        - root: The expanded root node
+    '''
+    def merge_symmetric_children(self, root):
+        stones = sum(1 for row in root.board for cell in row if cell != 0)
+        if stones > self.SYMMETRY_STONES:
+            return
+        moves = uniqueMoves(root.board, [move for _, move in root.candidates], root.current_player)
+        keep = set(moves)
+        root.candidates = [(prior, move) for prior, move in root.candidates if move in keep]
+
+    '''
+    Returns the root child or candidate move that leads to the same position as move, up to
+    symmetry, or move itself if there is none
+    '''
+    def symmetric_root_move(self, root, move):
+        hasher = SymmetricHash(self.board_size, root.board)
+        key = hasher.peek(move, root.current_player)[0]
+        for other in [child.move_loc for child in root.children] + [other for _, other in root.candidates]:
+            if hasher.peek(other, root.current_player)[0] == key:
+                return other
+        return move
 
     '''
-    Selects the child node of the current node with the highest UCT score
+    Returns the number of children a node may have for its current visit count
+    '''
+    def children_allowed(self, node):
+        return self.WIDEN_BASE + int(self.WIDEN_FACTOR * node.visits ** self.WIDEN_EXPONENT)
+
+    '''
+    Widens a node as far as its visit count and the remaining node budget allow, and keeps
+    the tree size statistics up to date. When the budget is used up leaves stay unexpanded
+    and are simply simulated from.
+    Parameters:
+        - node: The node to add children to
+    '''
+    def grow(self, node):
+        limit = self.children_allowed(node)
+        # The root always gets its first children so that there is a move to return
+        if self.MAX_NODES is not None and node.parent is not None:
+            limit = min(limit, len(node.children) + self.MAX_NODES - self.tree_size)
+        self.tree_size += node.widen(limit)
+        self.peak_tree_size = max(self.peak_tree_size, self.tree_size)
+
+    '''
+    Collapses the least visited subtrees below the root, keeping the collapsed nodes and
+    their statistics but dropping all of their descendants, until the tree is no larger
+    than PRUNE_FRACTION of MAX_NODES. Collapsed nodes are expanded again if the search
+    returns to them.
+    Parameters:
+        - root: The root node of the search tree
+    '''
+    def prune_tree(self, root):
+        # Collect every expanded node below the root
+        internal = []
+        stack = list(root.children)
+        while stack:
+            node = stack.pop()
+            if node.children:
+                internal.append(node)
+                stack.extend(node.children)
+
+        target = int(self.MAX_NODES * self.PRUNE_FRACTION)
+        for node in sorted(internal, key=lambda node: node.visits):
+            if self.tree_size <= target:
+                break
+            # Skip nodes that were inside a subtree which has already been collapsed
+            ancestor = node.parent
+            while ancestor is not None and ancestor is not root:
+                ancestor = ancestor.parent
+            if ancestor is None:
+                continue
+            self.tree_size -= self.subtree_size(node) - 1
+            for child in node.children:
+                child.parent = None
+            node.children = []
+            node.candidates = []
+            node.expanded = False
+
+    '''
+    Returns the number of nodes in the subtree rooted at node, including node itself
+    '''
+    def subtree_size(self, node):
+        size = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(node.children)
+        return size
+
+    '''
+    Updates the AMAF statistics of every child whose move was made by the same player
+    anywhere later in the playout, not just as the next move.
+    Parameters:
+        - node: The node whose children are updated
+        - played: The set of (move, player) pairs made below this node
+        - winner: The winner of the playout
+    '''
+    def update_amaf(self, node, played, winner):
+        if not self.RAVE_K:
+            return
+        for child in node.children:
+            if (child.move_loc, node.current_player) in played:
+                child.amaf_visits += 1
+                if winner == self.ID:
+                    child.amaf_wins += 1
+
+    '''
+    Selects the child node of the current node with the highest UCT score, with the win
+    rate blended with the child's AMAF win rate (RAVE). The AMAF weight starts at 1 and
+    falls off as sqrt(RAVE_K / (3 * visits + RAVE_K)) once real visits accumulate.
+    A PUCT style prior term, PUCT_C * prior * sqrt(total visits) / (1 + visits), steers
+    early visits towards moves the threat heuristic rates highly.
     Parameters:
         - node: The current node being checked
     Returns:
@@ -126,10 +457,16 @@ class Player(GomokuAgent):
         for child in node.children:
             # Calculate ratio of wins to visits, add 0.01 to avoid ZeroDivisionError
             exploit = child.wins / (child.visits + 0.01)
+            # Blend in the AMAF win rate, which has far more samples early on
+            if self.RAVE_K and child.amaf_visits:
+                beta = math.sqrt(self.RAVE_K / (3 * child.visits + self.RAVE_K))
+                exploit = (1 - beta) * exploit + beta * child.amaf_wins / child.amaf_visits
             # Calculate term based on total visists and visits to current child, add 0.01 to avoid ZeroDivisionError
             explore = math.sqrt(log_total / (child.visits + 0.01))
+            # Prior term, which fades as the child collects its own visits
+            bias = self.PUCT_C * child.prior * math.sqrt(total_visits) / (1 + child.visits)
             # Combine terms to give score for current child
-            score = exploit + explore
+            score = exploit + explore + bias
 
             # If the score is higher than the current best score, replace with current child
             if score > best_score:
@@ -167,85 +504,55 @@ class Player(GomokuAgent):
         return best_child
 
     '''
-    Simulate a game from the given node by selecting moves using a heuristic.
+    Simulate a game from the given node. Each ply the current player completes a line if it
+    can, otherwise blocks an opponent line that would be completed next move, otherwise plays
+    a random empty cell. The threat map makes each of these choices a lookup.
     Parameters:
         - node: A node object representing the current state of the game
+        - played: Optional set that each (move, player) made in the playout is added to
     Returns:
         - An integer (1 or -1) which indicates the winning player. 0 if draw.
     '''
-    def simulate(self, node):
-        # Create a copy of the board and set the current player
-        board = copy.deepcopy(node.board)
+    def simulate(self, node, played=None):
+        if played is None:
+            played = set()
+        # Copy the threat map and live windows of the root, built on the first playout, and make
+        # the moves down to this node on them instead of building both from the node's board.
+        # The live windows let the playout stop once the game is a certain draw
+        path = []
+        root = node
+        while root.parent is not None:
+            path.append((root.move_loc, -root.current_player))
+            root = root.parent
+        if root.threats is None:
+            root.threats = ThreatMap(root.board, self.x_in_a_line)
+            root.live = LiveWindows(root.board, self.x_in_a_line)
+        threats, live = root.threats.copy(), root.live.copy()
+        for move, player in reversed(path):
+            threats.place(move, player)
+            live.place(move, player)
         current_player = node.current_player
-        # Get the board size and number of pieces in a row needed to win
-        board_size = self.board_size
-        x_in_a_line = self.x_in_a_line
 
         while True:
-            # Get a list of all legal moves
-            legal_moves = [(i, j) for i in range(board_size) for j in range(board_size) if board[i][j] == 0]
             # Check for a draw
-            if not legal_moves:
+            if not threats.empty or live.isDead():
                 return 0
 
-            # Check for potential opponent wins and block them
-            opponent = -current_player
-            # Iterate over each legal move
-            for move in legal_moves:
-                # Check in each possible direction
-                for direction in [(1,0), (0,1), (1,1), (1,-1)]:
-                    count = 0
-                    # Iterate over each space around the move
-                    for i in range(-x_in_a_line+1, x_in_a_line):
-                        # Calculate the row and column coordinates
-                        row = move[0] + i * direction[0]
-                        col = move[1] + i * direction[1]
-                        # Check if the move is out of bounds or not an opponent piece
-                        if (row < 0 or row >= board_size or col < 0 or col >= board_size or
-                                board[row][col] != opponent):
-                            break # Stop counting if conditions are met
-                        count += 1
-                    if count >= x_in_a_line - 1:
-                        # Found a potential opponent win, block it
-                        board[move] = current_player
-                        # Check if the current player wins
-                        if winningTest(current_player, board, x_in_a_line):
-                            return current_player
-                        # Switch to other player
-                        current_player = -current_player
-
-            # Evaluate each move using a simple heuristic
-            scores = []
-            # Iterate over each legal move
-            for move in legal_moves:
-                score = 0
-                # Check in each possible direction
-                for direction in [(1,0), (0,1), (1,1), (1,-1)]:
-                    count = 0
-                    # Iterate over each space around the move
-                    for i in range(-x_in_a_line+1, x_in_a_line):
-                        # Calculate the row and column coordinates
-                        row = move[0] + i * direction[0]
-                        col = move[1] + i * direction[1]
-                        # Check if the move is out of bound or not a current player piece
-                        if (row < 0 or row >= board_size or col < 0 or col >= board_size or
-                                board[row][col] != current_player):
-                            break # Stop counting if conditions are met
-                        count += 1 # Increase count if conditions are not met
-                    if count >= x_in_a_line - 1: # Check if count is close or equal to 5 in a row
-                        score += count * count  # Add a bonus for longer lines
-                scores.append(score)
-
-            # Choose the move with the highest score
-            best_moves = [i for i in range(len(legal_moves)) if scores[i] == max(scores)]
-            move_index = choice(best_moves)
-            move = legal_moves[move_index]
-        
-            # Make the move on the board 
-            board[move] = current_player
-            
+            # Win if possible, otherwise block an opponent win, otherwise play anywhere
+            move = threats.winning_move(current_player)
+            if move is None:
+                move = threats.winning_move(-current_player)
+            if move is None:
+                move = choice(threats.empty)
+            wins = threats.completes_line(move, current_player)
+
+            # Make the move on the board
+            threats.place(move, current_player)
+            played.add((move, current_player))
+            live.place(move, current_player)
+
             # Check if the current player wins
-            if winningTest(current_player, board, x_in_a_line):
+            if wins:
                 return current_player
 
             # Switch to the other player
@@ -3,67 +3,223 @@ import copy
 import numpy as np
 from gomokuAgent import GomokuAgent
 import time
-from misc import legalMove, winningTest
+from misc import legalMove, winningTest, threatScore, LiveWindows, windowTable
+from symmetry import uniqueMoves, SymmetricHash
+from endgame import solveEndgame
 from random import randint, choice
 
 class Node:
-    def __init__(self, board, parent, current_player, move_loc):
+    def __init__(self, board, parent, current_player, move_loc, prior=0.0):
         self.board = board
         self.parent = parent
         self.current_player = current_player
         self.move_loc = move_loc
+        self.prior = prior
         self.children = []
+        # (prior, move) pairs not yet turned into children, best first
+        self.candidates = []
         self.visits = 0
         self.wins = 0
+        self.amaf_visits = 0
+        self.amaf_wins = 0
         self.expanded = False
 
-    def expand(self):
+    def expand(self, x_in_a_line):
         legal_moves = [(i, j) for i in range(len(self.board)) for j in range(len(self.board)) if self.board[i][j] == 0]
+        # nothing to search once the position is a certain draw, but the root must still offer a move
+        if self.parent is not None and LiveWindows(self.board, x_in_a_line).isDead():
+            legal_moves = []
 
-        for move in legal_moves:
-            new_board = copy.deepcopy(self.board)
-            new_board[move[0]][move[1]] = self.current_player
-            new_node = Node(new_board, self, -self.current_player, move)
-            self.children.append(new_node)
+        scores = [threatScore(self.board, move, self.current_player, x_in_a_line) + 1 for move in legal_moves]
+        total = sum(scores)
+        self.candidates = sorted(((score / total, move) for score, move in zip(scores, legal_moves)), reverse=True)
 
         self.expanded = True
 
+    def widen(self, limit):
+        added = 0
+        while len(self.children) < limit and self.candidates:
+            prior, move = self.candidates.pop(0)
+            self.add_child(move, prior)
+            added += 1
+        return added
+
+    def promote(self, move):
+        # turn one candidate into a child now, whatever its prior
+        for i, (prior, candidate) in enumerate(self.candidates):
+            if candidate == move:
+                del self.candidates[i]
+                self.add_child(move, prior)
+                return 1
+        return 0
+
+    def add_child(self, move, prior):
+        new_board = copy.deepcopy(self.board)
+        new_board[move[0]][move[1]] = self.current_player
+        self.children.append(Node(new_board, self, -self.current_player, move, prior))
+
 class Player(GomokuAgent):
     def __init__(self, ID, BOARD_SIZE, X_IN_A_LINE):
         self.ID = ID
         self.board_size = BOARD_SIZE
         self.x_in_a_line = X_IN_A_LINE
         self.TIME_OUT = 5
+        self.SYMMETRY_STONES = 4
+        # solve exactly once this few cells are empty
+        self.ENDGAME_EMPTY = 10
+        self.endgame_memo = {}
+        self.MAX_PLAYOUTS = None
+        self.RAVE_K = 300
+        self.PUCT_C = 1.0
+        self.WIDEN_BASE = 4
+        self.WIDEN_FACTOR = 1.0
+        self.WIDEN_EXPONENT = 0.5
+        # node budget (None for unlimited) and the fraction of it left after pruning
+        self.MAX_NODES = 20000
+        self.PRUNE_FRACTION = 0.75
+        self.tree_size = 0
+        self.peak_tree_size = 0
         self.transposition_table = {}
 
+    def prepare(self):
+        # build the lookup tables up front rather than inside the first move
+        windowTable(self.board_size, self.x_in_a_line)
+        SymmetricHash(self.board_size)
+
     def move(self, board):
+        if np.count_nonzero(board == 0) <= self.ENDGAME_EMPTY:
+            move, result = solveEndgame(board, self.ID, self.x_in_a_line, self.endgame_memo)
+            self.last_score = (result + 1) / 2
+            return move
+
+        # every move draws once no line can be completed
+        if LiveWindows(board, self.x_in_a_line).isDead():
+            self.last_score = 0.5
+            return next((r, c) for r in range(self.board_size) for c in range(self.board_size) if board[r][c] == 0)
+
+        root = self.search(board)
+
+        best_child = self.select_best_child(root)
+        self.last_score = best_child.wins / best_child.visits if best_child.visits else 0.0
+        return best_child.move_loc
+
+    # root_moves are made root children up front so they are searched whatever their prior
+    def search(self, board, root_moves=()):
         start_time = time.time()
         end_time = start_time + self.TIME_OUT
+        playouts = 0
 
         root = Node(board, None, self.ID, None)
+        self.tree_size = 1
+        root.expand(self.x_in_a_line)
+        self.merge_symmetric_children(root)
+        self.grow(root)
+        for move in root_moves:
+            self.tree_size += root.promote(self.symmetric_root_move(root, move))
 
-        while time.time() < end_time:
+        while time.time() < end_time and (self.MAX_PLAYOUTS is None or playouts < self.MAX_PLAYOUTS):
+            playouts += 1
+            if self.MAX_NODES is not None and self.tree_size >= self.MAX_NODES:
+                self.prune_tree(root)
             node = root
             # selection
             while node.children:
+                self.grow(node)
                 node = self.select_child(node)
 
-            # expansion
-            if not node.expanded:
-                node.expand()
+            # expansion, once a leaf has already been simulated
+            if not node.expanded and node.visits:
+                node.expand(self.x_in_a_line)
+                self.grow(node)
 
             # simulation
-            winner = self.simulate(node)
+            played = set()
+            winner = self.simulate(node, played=played)
 
             # backpropagation
             while node:
                 node.visits += 1
                 if winner == self.ID:
                     node.wins += 1
+                self.update_amaf(node, played, winner)
+                if node.move_loc is not None:
+                    played.add((node.move_loc, -node.current_player))
                 node = node.parent
 
-        best_child = self.select_best_child(root)
-        return best_child.move_loc
+        return root
+
+    def merge_symmetric_children(self, root):
+        # only near-empty boards have symmetric root moves worth merging
+        if np.count_nonzero(root.board) > self.SYMMETRY_STONES:
+            return
+        keep = set(uniqueMoves(root.board, [move for _, move in root.candidates], root.current_player))
+        root.candidates = [(prior, move) for prior, move in root.candidates if move in keep]
+
+    def symmetric_root_move(self, root, move):
+        # a move merged away by symmetry is stood in for by the kept move reaching the same position
+        hasher = SymmetricHash(self.board_size, root.board)
+        key = hasher.peek(move, root.current_player)[0]
+        for other in [child.move_loc for child in root.children] + [other for _, other in root.candidates]:
+            if hasher.peek(other, root.current_player)[0] == key:
+                return other
+        return move
+
+    def children_allowed(self, node):
+        # progressive widening: more children as the node collects visits
+        return self.WIDEN_BASE + int(self.WIDEN_FACTOR * node.visits ** self.WIDEN_EXPONENT)
+
+    def grow(self, node):
+        limit = self.children_allowed(node)
+        # stop adding nodes below the root once the budget is used up
+        if self.MAX_NODES is not None and node.parent is not None:
+            limit = min(limit, len(node.children) + self.MAX_NODES - self.tree_size)
+        self.tree_size += node.widen(limit)
+        self.peak_tree_size = max(self.peak_tree_size, self.tree_size)
+
+    def prune_tree(self, root):
+        # collapse the least visited subtrees until the tree is PRUNE_FRACTION of the budget
+        internal = []
+        stack = list(root.children)
+        while stack:
+            node = stack.pop()
+            if node.children:
+                internal.append(node)
+                stack.extend(node.children)
+
+        target = int(self.MAX_NODES * self.PRUNE_FRACTION)
+        for node in sorted(internal, key=lambda node: node.visits):
+            if self.tree_size <= target:
+                break
+            ancestor = node.parent
+            while ancestor is not None and ancestor is not root:
+                ancestor = ancestor.parent
+            if ancestor is None:
+                continue  # already removed with a collapsed ancestor
+            self.tree_size -= self.subtree_size(node) - 1
+            for child in node.children:
+                child.parent = None
+            node.children = []
+            node.candidates = []
+            node.expanded = False
+
+    def subtree_size(self, node):
+        size = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(node.children)
+        return size
+
+    def update_amaf(self, node, played, winner):
+        # all-moves-as-first: credit every child whose move this player made later in the playout
+        if not self.RAVE_K:
+            return
+        for child in node.children:
+            if (child.move_loc, node.current_player) in played:
+                child.amaf_visits += 1
+                if winner == self.ID:
+                    child.amaf_wins += 1
 
     def select_child(self, node):
         total_visits = sum(child.visits for child in node.children)
@@ -74,8 +230,13 @@ class Player(GomokuAgent):
 
         for child in node.children:
             exploit = child.wins / (child.visits + 0.1)
+            if self.RAVE_K and child.amaf_visits:
+                beta = math.sqrt(self.RAVE_K / (3 * child.visits + self.RAVE_K))
+                exploit = (1 - beta) * exploit + beta * child.amaf_wins / child.amaf_visits
             explore = math.sqrt(log_total / (child.visits + 0.1))
-            score = exploit + explore
+            # PUCT style prior term
+            bias = self.PUCT_C * child.prior * math.sqrt(total_visits) / (1 + child.visits)
+            score = exploit + explore + bias
 
             if score > best_score:
                 best_score = score
@@ -97,15 +258,18 @@ class Player(GomokuAgent):
 
         return best_child
 
-    def simulate(self, node, alpha=float("-inf"), beta=float("inf")):
+    def simulate(self, node, alpha=float("-inf"), beta=float("inf"), played=None):
+        if played is None:
+            played = set()
         board = copy.deepcopy(node.board)
         current_player = node.current_player
         board_size = self.board_size
         x_in_a_line = self.x_in_a_line
+        live = LiveWindows(board, x_in_a_line)
 
         while True:
             legal_moves = [(i, j) for i in range(board_size) for j in range(board_size) if board[i][j] == 0]
-            if not legal_moves:
+            if not legal_moves or live.isDead():
                 return 0
 
             # Evaluate each move using a simple heuristic
@@ -131,6 +295,8 @@ class Player(GomokuAgent):
             move = legal_moves[move_index]
 
             board[move] = current_player
+            played.add((move, current_player))
+            live.place(move, current_player)
 
             if winningTest(current_player, board, x_in_a_line):
                 return current_player
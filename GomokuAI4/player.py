@@ -1,7 +1,9 @@
 # Import required libraries
 import numpy as np
 from gomokuAgent import GomokuAgent
-from misc import legalMove, winningTest
+from misc import legalMove, windowTable, SearchBoard
+from symmetry import SymmetricHash
+from endgame import solveEndgame
 
 # Player class definition, inherits from GomokuAgent
 class Player(GomokuAgent):
@@ -11,28 +13,59 @@ class Player(GomokuAgent):
         super().__init__(ID, BOARD_SIZE, X_IN_A_LINE)
         # Sets the max depth of the minimax algorithm to 0
         self.MAX_DEPTH = 0
+        # Solve the position exactly, rather than with the heuristic, once this few cells are empty
+        self.ENDGAME_EMPTY = 10
+        # Positions solved by the endgame solver, kept between moves
+        self.endgame_memo = {}
+
+    # Builds the window and hash tables used by SearchBoard and the endgame solver before the first move
+    def prepare(self):
+        windowTable(self.BOARD_SIZE, self.X_IN_A_LINE)
+        SymmetricHash(self.BOARD_SIZE)
 
     # Overwriting the move function from GomokuAgent
     def move(self, board):
+        # With few empty cells left the exact solver is both faster and correct
+        if np.count_nonzero(board == 0) <= self.ENDGAME_EMPTY:
+            best_move, result = solveEndgame(board, self.ID, self.X_IN_A_LINE, self.endgame_memo)
+            self.last_score = result * 1000000
+            return best_move
         # Initialize variables
         best_move = None
         best_score = -np.inf
+        moves = self.generate_moves(board)
+        # Search all moves on one board, making and undoing each in turn
+        position = SearchBoard(board, self.X_IN_A_LINE, hashed=False)
         # Loop through all possible moves
-        for move in self.generate_moves(board):
-            # Create copy of the board, make current move on copy
-            new_board = np.copy(board)
-            new_board[move] = self.ID
-            # Calculate the score for current move using minimax algorithm
-            score = self.minimax(new_board, self.MAX_DEPTH, -np.inf, np.inf, False)
+        for move in moves:
+            score = self.search_move(position, move)
             # If score is greater than the previous best score then update the best move and best score
             if score > best_score:
                 best_move = move
                 best_score = score
+        # Keep the score of the chosen move so tools such as self-play can record it
+        self.last_score = best_score
         # Return best move
         print(best_score)
         print(best_move)
         return best_move
 
+    '''
+    Scores a single move for this player with the minimax search, leaving the board as it was
+    Parameters:
+        - position: SearchBoard holding the current state of the game
+        - move: the move to score
+        - depth: the search depth, MAX_DEPTH if not given
+    Returns:
+        - score: the minimax score of the position after the move
+    '''
+    def search_move(self, position, move, depth=None):
+        position.make(move, self.ID)
+        # Calculate the score for current move using minimax algorithm
+        score = self.minimax(position, self.MAX_DEPTH if depth is None else depth, -np.inf, np.inf, False)
+        position.undo()
+        return score
+
     '''
     Generates a list of legal moves for a given board
     Parameters:
@@ -103,7 +136,7 @@ class Player(GomokuAgent):
     '''
     This function is an implementation of the minimax algorith with alpha-beta pruning
     Parameters:
-        - board: current state of the game
+        - position: SearchBoard holding the current state of the game, moves are made and undone on it
         - depth: maximum depth for the algorithm to go through
         - alpha: the best value the maximising player can guarantee
         - beta: the best value the minimising player can guarantee
@@ -111,23 +144,27 @@ class Player(GomokuAgent):
     Returns:
         - score: the best score found by the algorithm
     '''
-    def minimax(self, board, depth, alpha, beta, maximizing_player):
+    def minimax(self, position, depth, alpha, beta, maximizing_player):
         # Check if current player has won the game
-        if winningTest(self.ID, board, self.X_IN_A_LINE):
+        if position.winner == self.ID:
             return 1000000 - depth
         # Check if other player has won the game
-        elif winningTest(-self.ID, board, self.X_IN_A_LINE):
+        elif position.winner == -self.ID:
             return -1000000 + depth
+        # Check if neither player can complete a line any more, which is a certain draw
+        elif position.live.isDead():
+            return 0
         # Check if maximum depth has been reached
         elif depth == 0:
-            return self.heuristic_score(board)
+            return self.heuristic_score(position.board)
         # Find best move if the current player is maximising
         if maximizing_player:
             max_score = -np.inf
-            for move in self.generate_moves(board):
-                new_board = np.copy(board)
-                new_board[move] = self.ID
-                score = self.minimax(new_board, depth - 1, alpha, beta, False)
+            # The board's empty cells are the same moves generate_moves finds, without rescanning the board
+            for move in sorted(position.candidates):
+                position.make(move, self.ID)
+                score = self.minimax(position, depth - 1, alpha, beta, False)
+                position.undo()
                 max_score = max(max_score, score)
                 alpha = max(alpha, score)
                 if beta <= alpha:
@@ -136,10 +173,10 @@ class Player(GomokuAgent):
         # Find worst move for the other player if the current player is minimising
         else:
             min_score = np.inf
-            for move in self.generate_moves(board):
-                new_board = np.copy(board)
-                new_board[move] = -self.ID
-                score = self.minimax(new_board, depth - 1, alpha, beta, True)
+            for move in sorted(position.candidates):
+                position.make(move, -self.ID)
+                score = self.minimax(position, depth - 1, alpha, beta, True)
+                position.undo()
                 min_score = min(min_score, score)
                 beta = min(beta, score)
                 if beta <= alpha:
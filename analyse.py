@@ -0,0 +1,261 @@
+#######################################################
+# Gomoku offline game analysis
+#
+# Re-searches every recorded position of a self-play corpus (see selfplay.py)
+# with a fixed-effort agent and reports blunders: moves whose score is far
+# below the best move's score.
+#
+# Examples:
+#   python analyse.py data/selfplay --agent GomokuAI4 --depth 1 --out analysis.bin
+#   python analyse.py data/selfplay --agent GomokuAI --playouts 2000 --out analysis.bin
+#
+
+import sys, os, argparse
+import multiprocessing as mp
+import numpy as np
+
+from selfplay import iter_shards, load_agent
+from symmetry import SymmetricHash
+from misc import SearchBoard
+
+# one record per analysed move in the output table
+ANALYSIS_DTYPE = np.dtype([
+    ("game_id", np.int64),
+    ("ply", np.int16),
+    ("to_move", np.int8),
+    ("move", np.int8, (2,)),
+    ("best_move", np.int8, (2,)),
+    ("played_score", np.float32),
+    ("best_score", np.float32),
+    ("loss", np.float32),
+    ("blunder", np.bool_),
+])
+
+# search answers kept between runs, keyed by position hash (see position_keys).
+# kind 0: the position's best move and score for the player to move.
+# kind 1: the score of a position reached by a move, for the player who made it.
+CACHE_DTYPE = np.dtype([
+    ("key", np.int64),
+    ("kind", np.int8),
+    ("score", np.float32),
+    ("move", np.int8, (2,)),
+])
+
+BEST, PLAYED = 0, 1
+
+# default blunder thresholds: heuristic points for alpha-beta, win rate for MCTS
+DEFAULT_THRESHOLD = {"alphabeta": 10000.0, "mcts": 0.2}
+
+'''
+Reads a whole analysis table or search cache written by this tool.
+'''
+def read_table(path, dtype=ANALYSIS_DTYPE):
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+    return np.fromfile(path, dtype=dtype)
+
+class SearchCache:
+    '''
+    Search answers keyed by (kind, position hash), loaded from and appended to a
+    fixed-record file. Moves are stored in the orientation the hash describes, so
+    that symmetric positions can share entries.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if path is not None:
+            for record in read_table(path, CACHE_DTYPE):
+                self.entries[(int(record["kind"]), int(record["key"]))] = (float(record["score"]), tuple(int(x) for x in record["move"]))
+
+    def get(self, kind, key):
+        return self.entries.get((kind, key))
+
+    def put(self, records):
+        new = np.zeros(len(records), dtype=CACHE_DTYPE)
+        for i, (kind, key, score, move) in enumerate(records):
+            self.entries[(kind, key)] = (score, move)
+            new[i] = (key, kind, score, move)
+        if self.path is not None and len(new):
+            with open(self.path, "ab") as f:
+                new.tofile(f)
+
+# per-process agents, built once by init_worker
+_agents = {}
+_args = None
+
+def init_worker(args):
+    global _args
+    _args = args
+    P = load_agent(args.agent)
+    for ID in (1, -1):
+        player = P.Player(ID, args.board_size, args.x_in_a_line)
+        player.prepare()
+        if args.kind == "mcts":
+            player.MAX_PLAYOUTS = args.playouts
+            player.TIME_OUT = float("inf")
+        _agents[ID] = player
+
+'''
+Searches one position in a worker process.
+Parameters:
+    - task: (board, to_move, played move)
+Returns:
+    - (best_move, best_score, played_score), scores from the mover's point of view.
+      An MCTS score is NaN if the move got no playouts.
+'''
+def search_position(task):
+    board, to_move, played = task
+    board = np.array(board, dtype=int)
+    player = _agents[to_move]
+    if _args.kind == "alphabeta":
+        best_move, best_score = None, -np.inf
+        moves = set(player.generate_moves(board))
+        moves.add(played)
+        played_score = None
+        # one board for the whole position, each move is made and undone on it
+        position = SearchBoard(board, _args.x_in_a_line, hashed=False)
+        for move in sorted(moves):
+            score = player.search_move(position, move, _args.depth)
+            if move == played:
+                played_score = score
+            if score > best_score:
+                best_move, best_score = move, score
+        return best_move, float(best_score), float(played_score)
+
+    # the played move is searched as a root child however low its prior
+    root = player.search(board, (played,))
+    best = player.select_best_child(root)
+    # symmetric root moves may have been merged, so match the played move by position
+    hasher = SymmetricHash(board.shape[0], board)
+    children = {hasher.peek(child.move_loc, to_move)[0]: child for child in root.children}
+    child = children[hasher.peek(played, to_move)[0]]
+    rate = lambda node: node.wins / node.visits if node.visits else float("nan")
+    return best.move_loc, rate(best), rate(child)
+
+'''
+Returns the cache keys of a position and of the position after the played move,
+and the transform from the board to the orientation the keys describe.
+MCTS answers are shared by all 8 symmetries of a position, through the canonical
+hash. The alpha-beta heuristic scores rotations and reflections of a position
+differently, so its answers are keyed by the identity hash and only shared by
+identical boards.
+Returns:
+    - (key, t, played_key)
+'''
+def position_keys(hasher, played, to_move, kind):
+    if kind == "mcts":
+        key, t = hasher.canonical()
+        return key, t, hasher.peek(played, to_move)[0]
+    hasher.toggle(played, to_move)
+    played_key = hasher.hash()
+    hasher.toggle(played, to_move)
+    return hasher.hash(), 0, played_key
+
+'''
+Yields (record, board) for every stored position, one shard at a time.
+'''
+def iter_positions(corpus):
+    for _, data in iter_shards(corpus):
+        for i in range(len(data["game_ids"])):
+            board = data["boards"][i]
+            record = (int(data["game_ids"][i]), int(data["plies"][i]), int(data["to_move"][i]),
+                      (int(data["moves"][i][0]), int(data["moves"][i][1])))
+            yield record, board
+
+'''
+Yields lists of at most size items from an iterator.
+'''
+def batches(iterator, size):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Find blunders in recorded self-play games.")
+    parser.add_argument("corpus", help="self-play output directory containing index.json")
+    parser.add_argument("--agent", default="GomokuAI4", help="agent package used for the search")
+    parser.add_argument("--depth", type=int, default=None, help="fixed alpha-beta depth")
+    parser.add_argument("--playouts", type=int, default=None, help="fixed MCTS playouts per position")
+    parser.add_argument("--threshold", type=float, default=None, help="score loss that counts as a blunder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=1024, help="positions in flight at once")
+    parser.add_argument("--cache", default=None, help="search cache file kept between runs, defaults to OUT.AGENT-EFFORT.cache")
+    parser.add_argument("--board-size", type=int, default=11)
+    parser.add_argument("--x-in-a-line", type=int, default=5)
+    parser.add_argument("--out", default="analysis.bin")
+    args = parser.parse_args(argv)
+    if args.playouts is not None:
+        args.kind = "mcts"
+    else:
+        args.kind = "alphabeta"
+        if args.depth is None:
+            args.depth = 0
+    # each mode drives a different agent interface
+    method = {"mcts": "search", "alphabeta": "search_move"}[args.kind]
+    if not hasattr(load_agent(args.agent).Player, method):
+        parser.error("%s cannot be used with %s, it has no %s()" % (
+            args.agent, "--playouts" if args.kind == "mcts" else "--depth", method))
+    if args.threshold is None:
+        args.threshold = DEFAULT_THRESHOLD[args.kind]
+    if args.cache is None:
+        effort = "p%d" % args.playouts if args.kind == "mcts" else "d%d" % args.depth
+        args.cache = "%s.%s-%s.cache" % (args.out, args.agent, effort)
+    return args
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cache = SearchCache(args.cache)
+    analysed = blunders = searched = 0
+
+    with mp.Pool(args.workers, initializer=init_worker, initargs=(args,)) as pool, open(args.out, "wb") as out:
+        for batch in batches(iter_positions(args.corpus), args.batch):
+            # look every position up in the cache before sending it to the pool, and send
+            # positions repeated within the batch, such as shared openings, only once
+            keys, tasks, pending, queued = [], [], [], set()
+            for (game_id, ply, to_move, played), board in batch:
+                hasher = SymmetricHash(board.shape[0], board)
+                key, t, played_key = position_keys(hasher, played, to_move, args.kind)
+                keys.append((hasher, key, t, played_key))
+                if (key, played_key) in queued:
+                    continue
+                if cache.get(BEST, key) is None or cache.get(PLAYED, played_key) is None:
+                    queued.add((key, played_key))
+                    tasks.append((board, to_move, played))
+                    pending.append(len(keys) - 1)
+
+            new_entries = []
+            for i, (best_move, best_score, played_score) in zip(pending, pool.imap(search_position, tasks, chunksize=8)):
+                hasher, key, t, played_key = keys[i]
+                new_entries.append((BEST, key, best_score, hasher.toCanonical(best_move, t)))
+                new_entries.append((PLAYED, played_key, played_score, (-1, -1)))
+            cache.put(new_entries)
+            searched += len(tasks)
+
+            rows = np.zeros(len(batch), dtype=ANALYSIS_DTYPE)
+            for row, ((game_id, ply, to_move, played), _), (hasher, key, t, played_key) in zip(rows, batch, keys):
+                best_score, best_move = cache.get(BEST, key)
+                played_score = cache.get(PLAYED, played_key)[0]
+                loss = best_score - played_score
+                row["game_id"], row["ply"], row["to_move"] = game_id, ply, to_move
+                row["move"] = played
+                row["best_move"] = hasher.fromCanonical(best_move, t)
+                row["played_score"], row["best_score"], row["loss"] = played_score, best_score, loss
+                row["blunder"] = loss >= args.threshold
+                if row["blunder"]:
+                    blunders += 1
+                    print("Game %d ply %d: player %d played %s (%.3f), best %s (%.3f)" % (
+                        game_id, ply, to_move, played, played_score, tuple(int(x) for x in row["best_move"]), best_score))
+            rows.tofile(out)
+            analysed += len(batch)
+
+    print("Analysed %d positions (%d searched, %d from cache), %d blunders." % (
+        analysed, searched, analysed - searched, blunders))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+from misc import SearchBoard, isWinningMove
+
+# results of a solved position, for the player to move
+WIN, DRAW, LOSS = 1, 0, -1
+
+'''
+Solves a position exactly with a memoised negamax over all remaining empty
+cells. Only practical when few cells are left; the agents call it below their
+ENDGAME_EMPTY threshold.
+Parameters:
+    - board: the current state of the board, with at least one empty cell
+    - playerID: the player to move
+    - X_IN_A_LINE: the number of stones in a row needed to win
+    - memo: optional dict of solved positions, which can be reused between calls
+Returns:
+    - (move, result): a best move and WIN, DRAW or LOSS for playerID with best play
+'''
+def solveEndgame(board, playerID, X_IN_A_LINE, memo=None):
+    if memo is None:
+        memo = {}
+    position = SearchBoard(board, X_IN_A_LINE)
+    return _negamax(position, playerID, LOSS, WIN, memo, True)
+
+# kinds of memo entry: the exact value, or a bound left by an alpha-beta cutoff
+EXACT, LOWER, UPPER = 0, 1, 2
+
+def _negamax(position, playerID, alpha, beta, memo, root=False):
+    moves = sorted(position.candidates)
+
+    # take a win straight away
+    for move in moves:
+        if _wins(position, move, playerID):
+            return move, WIN
+
+    # a single opponent threat must be blocked; two or more cannot all be
+    threats = [move for move in moves if _wins(position, move, -playerID)]
+    if len(threats) > 1:
+        return threats[0], LOSS
+    if threats:
+        moves = threats
+
+    # the memo only holds values, so the root is always searched for its move
+    key = (position.hash.canonical()[0], playerID)
+    entry = memo.get(key)
+    if entry is not None and not root:
+        value, kind = entry
+        if kind == EXACT or (kind == LOWER and value >= beta) or (kind == UPPER and value <= alpha):
+            return None, value
+
+    original_alpha = alpha
+    best_move, best = moves[0], None
+    for move in moves:
+        position.make(move, playerID)
+        if position.isDraw():
+            result = DRAW
+        else:
+            result = -_negamax(position, -playerID, -beta, -alpha, memo)[1]
+        position.undo()
+        if best is None or result > best:
+            best_move, best = move, result
+        alpha = max(alpha, best)
+        if alpha >= beta:
+            break
+
+    if best <= original_alpha:
+        memo[key] = (best, UPPER)
+    elif best >= beta:
+        memo[key] = (best, LOWER)
+    else:
+        memo[key] = (best, EXACT)
+    return best_move, best
+
+'''
+Tests whether playerID completes a line by playing move, without making the move.
+'''
+def _wins(position, move, playerID):
+    board = position.board
+    board[move] = playerID
+    wins = isWinningMove(board, move, playerID, position.X_IN_A_LINE)
+    board[move] = 0
+    return wins
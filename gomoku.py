@@ -6,7 +6,7 @@
 # Mar 2023
 #
 
-import sys, time, signal
+import sys, time, signal, threading
 import numpy as np
 import os
 
@@ -15,11 +15,12 @@ import concurrent.futures
 from time import time
 from random import randint
 
-from misc import winningTest, legalMove
+from misc import winningTest, legalMove, LiveWindows
 
 BOARD_SIZE = 11   # size of the board is 11-by-11
 X_IN_A_LINE = 5   # play the standard game with 5 stones in a line
 TIME_OUT = 5     # player must return a move within 5 seconds
+PREPARE_TIME_OUT = 30   # player must finish its one-off prepare() within 30 seconds
 
 # an empty class to host the time-out exception
 class TimeOutException(Exception):
@@ -31,8 +32,27 @@ def handler(signum, frame):
     raise TimeOutException()
 
 
+# one-off setup before the first turn, not counted against TIME_OUT
+# prepare() runs on a daemon thread, so an overrunning one is abandoned
+# rather than waited for, here or at exit
+def prepare(player, turn_id):
+    future = concurrent.futures.Future()
+    def run():
+        try:
+            future.set_result(player.prepare())
+        except Exception as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        future.result(PREPARE_TIME_OUT)
+    except concurrent.futures.TimeoutError:
+        print("Player" + str(turn_id) + " prepare time out.")
+        return False
+    return True
+
 # turn taking function
-def turn(board, player, turn_id):
+# live is an optional LiveWindows tracker that is updated with the move
+def turn(board, player, turn_id, live=None):
 
     # make a copy of the board, which is passed to the agent
     tempBoard = np.array(board)
@@ -53,6 +73,8 @@ def turn(board, player, turn_id):
     # test if the move is legal - on the original board
     if legalMove(board, moveLoc):
         board[moveLoc] = player.ID
+        if live is not None:
+            live.place(moveLoc, player.ID)
     else:
         print("Player " + str(player.ID) + " illegal move at " + str(moveLoc))
         return turn_id*-1, board
@@ -80,8 +102,16 @@ def main():
     player1 = P1.Player(1, BOARD_SIZE, X_IN_A_LINE)
     player2 = P2.Player(-1, BOARD_SIZE, X_IN_A_LINE)
 
+    # let both players set up before the clock starts
+    for player, turn_id in [(player1, 1), (player2, -1)]:
+        if not prepare(player, turn_id):
+            print("Winner: " + str(-turn_id))
+            return 0
+
     # initialize the board
     board = np.zeros((BOARD_SIZE, BOARD_SIZE), dtype=int)
+    # lines that can still be completed, to spot a drawn game before the board is full
+    live = LiveWindows(board, X_IN_A_LINE)
 
     # connect the alarm signal with the handler
     # signal.signal(signal.SIGALRM, handler)
@@ -91,9 +121,9 @@ def main():
     while True:
         end = False
         for player, turn_id in [(player1, 1), (player2, -1)]:
-            id, board = turn(board, player, turn_id)
+            id, board = turn(board, player, turn_id, live)
             print(board)
-            if not 0 in board:
+            if not 0 in board or (id == 0 and live.isDead()):
                 print("Draw.")
                 end = True
                 break
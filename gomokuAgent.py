@@ -4,5 +4,10 @@ class GomokuAgent:
         self.BOARD_SIZE = BOARD_SIZE
         self.X_IN_A_LINE = X_IN_A_LINE
 
+    # called once before the first move, outside the move clock,
+    # for one-off setup such as building lookup tables
+    def prepare(self):
+        pass
+
     def move(self, board):
         return (0,0)
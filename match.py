@@ -0,0 +1,176 @@
+#######################################################
+# Gomoku A/B match harness
+#
+# Plays a candidate agent package against a baseline in colour-swapped pairs
+# of games with shared seeds, and stops as soon as a sequential probability
+# ratio test (SPRT) is conclusive. The two games of a pair are correlated, so
+# the test is run on finished pairs (the pentanomial model), not on games.
+#
+# Example:
+#   python match.py GomokuAI GomokuAI_new --elo0 0 --elo1 20 --move-time 1
+#
+
+import sys, os, math, argparse
+import multiprocessing as mp
+
+from selfplay import load_agent, play_game, seed_everything
+
+BOARD_SIZE = 11
+X_IN_A_LINE = 5
+
+'''
+Expected score of a player rated elo points above its opponent.
+'''
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+'''
+Elo difference that gives the expected score.
+'''
+def score_to_elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+# the candidate's mean score over the two games of a pair, for each pair outcome
+PAIR_SCORES = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+# pairs of each outcome added when estimating the variance, so that a run of
+# identical pairs still has a positive variance
+PRIOR_PAIRS = 0.1
+
+'''
+Mean and per-pair variance of the candidate's score.
+Parameters:
+    - pairs: the number of finished pairs with each outcome in PAIR_SCORES
+The mean is taken over the pairs played; the variance also counts
+PRIOR_PAIRS of each outcome.
+'''
+def score_stats(pairs):
+    n = sum(pairs)
+    mean = sum(count * score for count, score in zip(pairs, PAIR_SCORES)) / n
+    prior = [count + PRIOR_PAIRS for count in pairs]
+    prior_mean = sum(count * score for count, score in zip(prior, PAIR_SCORES)) / sum(prior)
+    var = sum(count * (score - prior_mean) ** 2 for count, score in zip(prior, PAIR_SCORES)) / sum(prior)
+    return mean, var
+
+'''
+Log-likelihood ratio of H1 (elo = elo1) against H0 (elo = elo0), using the
+normal approximation of the generalised SPRT on pentanomial pair counts.
+'''
+def sprt_llr(pairs, elo0, elo1):
+    n = sum(pairs)
+    if n == 0:
+        return 0.0
+    mean, var = score_stats(pairs)
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return n * (s1 - s0) * (2 * mean - s0 - s1) / (2 * var)
+
+'''
+Lower and upper LLR bounds for the given error rates.
+'''
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+'''
+Elo estimate with a 95% confidence interval.
+Returns:
+    - (elo, lower, upper). A bound is +inf or -inf when the interval reaches a
+      score of 1 or 0, as it does for the estimate once a side has no results.
+'''
+def elo_estimate(pairs):
+    mean, var = score_stats(pairs)
+    margin = 1.96 * math.sqrt(var / sum(pairs))
+    return score_to_elo(mean), score_to_elo(mean - margin), score_to_elo(mean + margin)
+
+'''
+Plays one game of a pair in a worker process.
+Parameters:
+    - task: (args, game index). Even games give the candidate the first move,
+      odd games swap colours and reuse the seed of the pair.
+An agent raising from move() loses the game, as for an illegal move.
+Returns:
+    - (game, score): the candidate's score is 1 for a win, 0.5 for a draw, 0 for a loss
+'''
+def play_match_game(task):
+    args, game = task
+    Baseline, Candidate = load_agent(args.baseline), load_agent(args.candidate)
+    candidate_id = 1 if game % 2 == 0 else -1
+    seed_everything(args.seed + game // 2)
+    if candidate_id == 1:
+        player1 = Candidate.Player(1, args.board_size, args.x_in_a_line)
+        player2 = Baseline.Player(-1, args.board_size, args.x_in_a_line)
+    else:
+        player1 = Baseline.Player(1, args.board_size, args.x_in_a_line)
+        player2 = Candidate.Player(-1, args.board_size, args.x_in_a_line)
+    for player in (player1, player2):
+        if args.move_time is not None and hasattr(player, "TIME_OUT"):
+            player.TIME_OUT = args.move_time
+    winner, _ = play_game(player1, player2, args.board_size, args.x_in_a_line, catch_errors=True)
+    if winner == 0:
+        return game, 0.5
+    return game, 1.0 if winner == candidate_id else 0.0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="SPRT match between two agent packages.")
+    parser.add_argument("baseline", help="baseline agent package")
+    parser.add_argument("candidate", help="candidate agent package")
+    parser.add_argument("--elo0", type=float, default=0.0, help="Elo gain under H0")
+    parser.add_argument("--elo1", type=float, default=20.0, help="Elo gain under H1")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--max-games", type=int, default=1000, help="rounded up to whole pairs")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--move-time", type=float, default=None, help="override the agents' TIME_OUT")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE)
+    parser.add_argument("--x-in-a-line", type=int, default=X_IN_A_LINE)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    lower, upper = sprt_bounds(args.alpha, args.beta)
+    games = args.max_games + args.max_games % 2
+    wins = draws = losses = 0
+    # finished pairs by outcome, and the score of each pair's first finished game
+    pairs = [0] * len(PAIR_SCORES)
+    halves = {}
+    result = "Inconclusive after %d games." % games
+
+    pool = mp.Pool(max(1, args.workers))
+    try:
+        tasks = ((args, game) for game in range(games))
+        for game, score in pool.imap_unordered(play_match_game, tasks):
+            if score == 1.0:
+                wins += 1
+            elif score == 0.5:
+                draws += 1
+            else:
+                losses += 1
+            if game // 2 not in halves:
+                halves[game // 2] = score
+                continue
+            pairs[int(2 * (halves.pop(game // 2) + score))] += 1
+            llr = sprt_llr(pairs, args.elo0, args.elo1)
+            elo, elo_low, elo_high = elo_estimate(pairs)
+            print("Pairs %d: %s  Games: +%d =%d -%d  Elo %.1f [%.1f, %.1f]  LLR %.2f [%.2f, %.2f]" % (
+                sum(pairs), "-".join(str(count) for count in pairs), wins, draws, losses,
+                elo, elo_low, elo_high, llr, lower, upper))
+            if llr >= upper:
+                result = "H1 accepted: %s is stronger than %s." % (args.candidate, args.baseline)
+                break
+            if llr <= lower:
+                result = "H0 accepted: %s is not stronger than %s." % (args.candidate, args.baseline)
+                break
+    finally:
+        # stop the games still in progress once the test has concluded
+        pool.terminate()
+        pool.join()
+
+    print(result)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
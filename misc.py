@@ -1,5 +1,8 @@
 import sys
 import numpy as np
+from functools import lru_cache
+
+from symmetry import SymmetricHash
 
 def legalMove(board, moveLoc):
     BOARD_SIZE = board.shape[0]
@@ -49,3 +52,170 @@ def winningTest(playerID, board, X_IN_A_LINE):
         return True
     
     return False
+
+'''
+Cheap threat heuristic used to order and weight candidate moves. For each of the
+4 line directions it counts the stones of each player running contiguously from
+both sides of the move, and rewards long runs (own runs to extend, opponent runs
+to block) steeply. Stones within two cells add a small bonus, so moves next to
+nothing score 0.
+'''
+def threatScore(board, moveLoc, playerID, X_IN_A_LINE):
+    BOARD_SIZE = len(board)
+    r0, c0 = moveLoc
+    score = 0
+    for dr, dc in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        for owner, weight in ((playerID, 2), (-playerID, 1)):
+            run = 0
+            for sign in (1, -1):
+                for i in range(1, X_IN_A_LINE):
+                    r, c = r0 + sign * i * dr, c0 + sign * i * dc
+                    if r < 0 or r >= BOARD_SIZE or c < 0 or c >= BOARD_SIZE or board[r][c] != owner:
+                        break
+                    run += 1
+            if run:
+                # a run of X-1 means this move wins (own) or must be blocked (opponent)
+                score += weight * 8 ** min(run, X_IN_A_LINE - 1)
+    for r in range(max(0, r0 - 2), min(BOARD_SIZE, r0 + 3)):
+        for c in range(max(0, c0 - 2), min(BOARD_SIZE, c0 + 3)):
+            if board[r][c] != 0:
+                score += 1
+    return score
+
+'''
+Lists every length X_IN_A_LINE window on the board, as tuples of flat cell
+indices (row * BOARD_SIZE + col), and for each cell the windows containing it.
+Returns:
+    - (windows, cellWindows)
+'''
+@lru_cache(maxsize=None)
+def windowTable(BOARD_SIZE, X_IN_A_LINE):
+    windows = []
+    cellWindows = [[] for _ in range(BOARD_SIZE * BOARD_SIZE)]
+    for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        for r in range(BOARD_SIZE):
+            for c in range(BOARD_SIZE):
+                endR, endC = r + dr * (X_IN_A_LINE - 1), c + dc * (X_IN_A_LINE - 1)
+                if endR < 0 or endR >= BOARD_SIZE or endC < 0 or endC >= BOARD_SIZE:
+                    continue
+                window = tuple((r + i * dr) * BOARD_SIZE + c + i * dc for i in range(X_IN_A_LINE))
+                for cell in window:
+                    cellWindows[cell].append(len(windows))
+                windows.append(window)
+    return tuple(windows), tuple(tuple(w) for w in cellWindows)
+
+class LiveWindows:
+    '''
+    Counts, for each player, the windows that hold none of the opponent's stones
+    and so could still become X_IN_A_LINE in a row. Updated in O(windows per cell)
+    as stones are placed or removed. Once neither player has a live window the
+    game can only end in a draw.
+    '''
+    def __init__(self, board, X_IN_A_LINE):
+        self.BOARD_SIZE = len(board)
+        windows, self.cellWindows = windowTable(self.BOARD_SIZE, X_IN_A_LINE)
+        # stones of each player in each window
+        self.counts = {1: [0] * len(windows), -1: [0] * len(windows)}
+        self.live = {1: len(windows), -1: len(windows)}
+        for r in range(self.BOARD_SIZE):
+            for c in range(self.BOARD_SIZE):
+                if board[r][c] != 0:
+                    self.place((r, c), int(board[r][c]))
+
+    def place(self, moveLoc, playerID):
+        own = self.counts[playerID]
+        for w in self.cellWindows[moveLoc[0] * self.BOARD_SIZE + moveLoc[1]]:
+            if own[w] == 0:
+                self.live[-playerID] -= 1
+            own[w] += 1
+
+    def remove(self, moveLoc, playerID):
+        own = self.counts[playerID]
+        for w in self.cellWindows[moveLoc[0] * self.BOARD_SIZE + moveLoc[1]]:
+            own[w] -= 1
+            if own[w] == 0:
+                self.live[-playerID] += 1
+
+    def isDead(self):
+        return self.live[1] == 0 and self.live[-1] == 0
+
+    def copy(self):
+        other = LiveWindows.__new__(LiveWindows)
+        other.BOARD_SIZE = self.BOARD_SIZE
+        other.cellWindows = self.cellWindows
+        other.counts = {1: list(self.counts[1]), -1: list(self.counts[-1])}
+        other.live = dict(self.live)
+        return other
+
+'''
+Tests whether the stone of playerID at moveLoc is part of X_IN_A_LINE in a row.
+Only the 4 lines through moveLoc are scanned, so after each move this gives the
+same answer as winningTest in O(X_IN_A_LINE).
+'''
+def isWinningMove(board, moveLoc, playerID, X_IN_A_LINE):
+    BOARD_SIZE = len(board)
+    for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        count = 1
+        for sign in (1, -1):
+            r, c = moveLoc[0] + sign * dr, moveLoc[1] + sign * dc
+            while 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and board[r][c] == playerID:
+                count += 1
+                r, c = r + sign * dr, c + sign * dc
+        if count >= X_IN_A_LINE:
+            return True
+    return False
+
+'''
+A board for the search that is changed in place with make and undo, instead of
+copying the board for every child. Each move updates, in one place, the board
+cells, the set of empty cells, the live window counts, the winner and, unless
+hashed is False, the symmetric Zobrist hash, so none of them need recomputing
+from scratch at a node. Searches that never read the hash should turn it off,
+as it is the most expensive part to keep up to date.
+'''
+class SearchBoard:
+    def __init__(self, board, X_IN_A_LINE, hashed=True):
+        self.board = np.array(board)
+        self.X_IN_A_LINE = X_IN_A_LINE
+        self.hash = SymmetricHash(len(self.board), self.board) if hashed else None
+        self.live = LiveWindows(self.board, X_IN_A_LINE)
+        # Empty cells, i.e. the moves still available
+        self.candidates = set((r, c) for r in range(len(self.board)) for c in range(len(self.board)) if self.board[r, c] == 0)
+        # The player with X_IN_A_LINE in a row, 0 if there is none
+        self.winner = 0
+        for playerID in (1, -1):
+            if winningTest(playerID, self.board, X_IN_A_LINE):
+                self.winner = playerID
+        # Moves made so far, with the winner before each one, for undo
+        self.history = []
+
+    '''
+    Places a stone for playerID at move
+    '''
+    def make(self, move, playerID):
+        self.board[move] = playerID
+        if self.hash is not None:
+            self.hash.toggle(move, playerID)
+        self.live.place(move, playerID)
+        self.candidates.discard(move)
+        self.history.append((move, self.winner))
+        if self.winner == 0 and isWinningMove(self.board, move, playerID, self.X_IN_A_LINE):
+            self.winner = playerID
+
+    '''
+    Takes back the last move made
+    '''
+    def undo(self):
+        move, self.winner = self.history.pop()
+        playerID = self.board[move]
+        self.board[move] = 0
+        if self.hash is not None:
+            self.hash.toggle(move, playerID)
+        self.live.remove(move, playerID)
+        self.candidates.add(move)
+
+    '''
+    True if the game can only end in a draw from here
+    '''
+    def isDraw(self):
+        return not self.candidates or self.live.isDead()
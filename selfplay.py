@@ -0,0 +1,232 @@
+#######################################################
+# Gomoku self-play data generation
+#
+# Plays agent-vs-agent games on every core and writes the sampled positions,
+# search scores and final outcomes to sharded, compressed .npz files.
+#
+# Example:
+#   python selfplay.py GomokuAI4 GomokuAI4 --games 1000 --out data/selfplay
+#
+
+import sys, os, json, argparse, random, traceback
+import multiprocessing as mp
+from queue import Empty
+import numpy as np
+
+from misc import winningTest, legalMove, LiveWindows
+
+BOARD_SIZE = 11
+X_IN_A_LINE = 5
+
+# every record written to a shard is one row of each of these arrays
+SHARD_FIELDS = {
+    "boards": np.int8,     # position before the move, (N, BOARD_SIZE, BOARD_SIZE)
+    "to_move": np.int8,    # ID of the player about to move
+    "moves": np.int8,      # move played, (N, 2)
+    "scores": np.float32,  # the mover's search score for the move, NaN if the agent has none
+    "outcomes": np.int8,   # winner of the game, 0 for a draw
+    "game_ids": np.int64,
+    "plies": np.int16,
+}
+
+'''
+Loads the player module of an agent package, as gomoku.py does.
+'''
+def load_agent(agentDir):
+    return getattr(__import__(agentDir, fromlist=["player"]), "player")
+
+'''
+Plays one untimed game between two agents.
+Parameters:
+    - player1: the agent with ID 1, which moves first
+    - player2: the agent with ID -1
+    - on_move: optional callback(board, player, move, ply) called before each move is made
+    - catch_errors: if True, a player whose move() raises loses the game and the
+      traceback is printed, instead of the exception propagating
+The players' prepare() is called before the first move.
+Returns:
+    - winner: 1 or -1, or 0 for a draw, which is declared as soon as neither
+      player can complete a line. A player making an illegal move loses.
+    - moves: the list of moves played
+'''
+def play_game(player1, player2, BOARD_SIZE, X_IN_A_LINE, on_move=None, catch_errors=False):
+    for player in (player1, player2):
+        player.prepare()
+    board = np.zeros((BOARD_SIZE, BOARD_SIZE), dtype=int)
+    live = LiveWindows(board, X_IN_A_LINE)
+    moves = []
+    ply = 0
+    while True:
+        for player in (player1, player2):
+            try:
+                moveLoc = player.move(np.array(board))
+            except Exception:
+                if not catch_errors:
+                    raise
+                traceback.print_exc()
+                return -player.ID, moves
+            if not legalMove(board, moveLoc):
+                return -player.ID, moves
+            moveLoc = (int(moveLoc[0]), int(moveLoc[1]))
+            if on_move is not None:
+                on_move(board, player, moveLoc, ply)
+            board[moveLoc] = player.ID
+            live.place(moveLoc, player.ID)
+            moves.append(moveLoc)
+            ply += 1
+            if winningTest(player.ID, board, X_IN_A_LINE):
+                return player.ID, moves
+            # drawn once the board is full or no line can be completed by either player
+            if not 0 in board or live.isDead():
+                return 0, moves
+
+'''
+Seeds both random number generators used by the agents.
+'''
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+'''
+Worker process: plays games game_id = worker_id, worker_id + workers, ...
+and puts one list of sampled records per finished game on the queue.
+If a game raises, the traceback is put on the queue as a string and the
+worker stops. A None is always put on the queue when the worker is done.
+'''
+def worker(worker_id, args, queue):
+    try:
+        P1, P2 = load_agent(args.player1), load_agent(args.player2)
+        rng = random.Random(args.seed * 7919 + worker_id)
+        for game_id in range(worker_id, args.games, args.workers):
+            seed_everything(args.seed + game_id)
+            player1 = P1.Player(1, args.board_size, args.x_in_a_line)
+            player2 = P2.Player(-1, args.board_size, args.x_in_a_line)
+            for player in (player1, player2):
+                if args.move_time is not None and hasattr(player, "TIME_OUT"):
+                    player.TIME_OUT = args.move_time
+
+            samples = []
+            def record(board, player, moveLoc, ply):
+                if rng.random() < args.sample_rate:
+                    samples.append((np.array(board, dtype=np.int8), player.ID, moveLoc,
+                                    getattr(player, "last_score", float("nan")), ply))
+
+            winner, _ = play_game(player1, player2, args.board_size, args.x_in_a_line, record)
+            # blocks while the writer is behind, which keeps memory bounded
+            queue.put([(b, p, m, s, winner, game_id, ply) for b, p, m, s, ply in samples])
+    except Exception:
+        queue.put("Worker %d failed:\n%s" % (worker_id, traceback.format_exc()))
+    finally:
+        queue.put(None)
+
+class ShardWriter:
+    '''
+    Buffers records and writes them out as fixed-size compressed .npz shards,
+    keeping index.json in the output directory up to date after every shard.
+    '''
+    def __init__(self, out_dir, shard_size, meta):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.buffer = []
+        self.index = {"meta": meta, "fields": list(SHARD_FIELDS), "shards": []}
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = list(zip(*self.buffer))
+        arrays = {name: np.array(column, dtype=dtype) for (name, dtype), column in zip(SHARD_FIELDS.items(), columns)}
+        name = "shard-%05d.npz" % len(self.index["shards"])
+        np.savez_compressed(os.path.join(self.out_dir, name), **arrays)
+        self.index["shards"].append({
+            "file": name,
+            "positions": len(self.buffer),
+            "games": sorted(set(int(g) for g in arrays["game_ids"])),
+        })
+        self.buffer = []
+        self.write_index()
+
+    def write_index(self):
+        tmp = os.path.join(self.out_dir, "index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, os.path.join(self.out_dir, "index.json"))
+
+'''
+Yields (shard_name, arrays) for every shard listed in a self-play index,
+loading one shard at a time.
+'''
+def iter_shards(out_dir):
+    with open(os.path.join(out_dir, "index.json")) as f:
+        index = json.load(f)
+    for shard in index["shards"]:
+        with np.load(os.path.join(out_dir, shard["file"])) as data:
+            yield shard["file"], {name: data[name] for name in data.files}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate self-play positions for tuning.")
+    parser.add_argument("player1", help="agent package playing as 1")
+    parser.add_argument("player2", help="agent package playing as -1")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="fraction of positions to keep")
+    parser.add_argument("--move-time", type=float, default=None, help="override the agents' TIME_OUT")
+    parser.add_argument("--shard-size", type=int, default=100000, help="positions per shard")
+    parser.add_argument("--queue-size", type=int, default=64, help="finished games buffered between workers and writer")
+    parser.add_argument("--board-size", type=int, default=BOARD_SIZE)
+    parser.add_argument("--x-in-a-line", type=int, default=X_IN_A_LINE)
+    parser.add_argument("--out", default="selfplay")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    args.workers = max(1, min(args.workers, args.games))
+
+    queue = mp.Queue(maxsize=args.queue_size)
+    workers = [mp.Process(target=worker, args=(i, args, queue), daemon=True) for i in range(args.workers)]
+    for p in workers:
+        p.start()
+
+    meta = {k: v for k, v in vars(args).items() if k not in ("out", "workers", "queue_size")}
+    writer = ShardWriter(args.out, args.shard_size, meta)
+    running, games, failed = args.workers, 0, False
+    while running:
+        try:
+            records = queue.get(timeout=1)
+        except Empty:
+            # a worker killed outright, e.g. by a signal, never sends its None
+            if any(p.exitcode is not None and p.exitcode != 0 for p in workers):
+                print("\nA worker died without finishing its games.", file=sys.stderr)
+                failed = True
+                break
+            continue
+        if records is None:
+            running -= 1
+            continue
+        if isinstance(records, str):
+            print("\n" + records, file=sys.stderr)
+            failed = True
+            break
+        for record in records:
+            writer.add(record)
+        games += 1
+        print("Games: %d/%d" % (games, args.games), end="\r")
+    # keep the games finished so far, even if the run failed
+    writer.flush()
+    writer.write_index()
+    print()
+
+    for p in workers:
+        if failed:
+            p.terminate()
+        p.join()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
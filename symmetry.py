@@ -0,0 +1,175 @@
+import numpy as np
+from functools import lru_cache
+
+# number of dihedral symmetries of a square board (4 rotations x 2 reflections)
+TRANSFORMS = 8
+
+# fixed seed so the same position hashes identically in every process
+ZOBRIST_SEED = 20230301
+
+'''
+Maps a move through one of the 8 board symmetries.
+Transform t reflects the columns when t >= 4, then rotates by (t % 4) quarter
+turns in the same direction as np.rot90.
+Parameters:
+    - move: the (row, col) location to transform
+    - t: the transform index, 0 to 7
+    - BOARD_SIZE: the size of the board
+Returns:
+    - the transformed (row, col) location
+'''
+def transformMove(move, t, BOARD_SIZE):
+    n = BOARD_SIZE - 1
+    r, c = move
+    if t >= 4:
+        c = n - c
+    for _ in range(t % 4):
+        r, c = n - c, r
+    return (r, c)
+
+'''
+Returns the transform index that undoes transform t.
+'''
+def inverseTransform(t):
+    return _inverseTable()[t]
+
+@lru_cache(maxsize=None)
+def _inverseTable():
+    # a 3x3 probe is enough to tell all 8 symmetries apart
+    probes = [(0, 1), (1, 2)]
+    inverse = []
+    for t in range(TRANSFORMS):
+        for u in range(TRANSFORMS):
+            if all(transformMove(transformMove(p, t, 3), u, 3) == p for p in probes):
+                inverse.append(u)
+                break
+    return tuple(inverse)
+
+'''
+Builds, for every transform, the flat index each cell is mapped to.
+'''
+@lru_cache(maxsize=None)
+def transformTable(BOARD_SIZE):
+    table = []
+    for t in range(TRANSFORMS):
+        row = []
+        for r in range(BOARD_SIZE):
+            for c in range(BOARD_SIZE):
+                tr, tc = transformMove((r, c), t, BOARD_SIZE)
+                row.append(tr * BOARD_SIZE + tc)
+        table.append(tuple(row))
+    return tuple(table)
+
+'''
+Random 64-bit Zobrist keys, one per (player, cell). Index 0 is player 1 and
+index 1 is player -1.
+'''
+@lru_cache(maxsize=None)
+def zobristKeys(BOARD_SIZE):
+    rng = np.random.default_rng(ZOBRIST_SEED + BOARD_SIZE)
+    keys = rng.integers(1, 2**63, size=(2, BOARD_SIZE * BOARD_SIZE), dtype=np.int64)
+    return tuple(tuple(int(k) for k in player) for player in keys)
+
+class SymmetricHash:
+    '''
+    Keeps the Zobrist hash of all 8 orientations of a board up to date as
+    stones are placed or removed, so the canonical (minimal) hash never
+    requires materialising rotated or flipped copies of the board.
+    '''
+    def __init__(self, BOARD_SIZE, board=None):
+        self.BOARD_SIZE = BOARD_SIZE
+        self.keys = zobristKeys(BOARD_SIZE)
+        self.table = transformTable(BOARD_SIZE)
+        # hashes[t] is the hash of the board seen through transform t
+        self.hashes = [0] * TRANSFORMS
+        if board is not None:
+            for r in range(BOARD_SIZE):
+                for c in range(BOARD_SIZE):
+                    if board[r][c] != 0:
+                        self.toggle((r, c), board[r][c])
+
+    def copy(self):
+        other = SymmetricHash.__new__(SymmetricHash)
+        other.BOARD_SIZE = self.BOARD_SIZE
+        other.keys = self.keys
+        other.table = self.table
+        other.hashes = list(self.hashes)
+        return other
+
+    '''
+    Adds or removes (XOR is its own inverse) a stone of playerID at move.
+    '''
+    def toggle(self, move, playerID):
+        keys = self.keys[0 if playerID == 1 else 1]
+        idx = move[0] * self.BOARD_SIZE + move[1]
+        hashes = self.hashes
+        for t in range(TRANSFORMS):
+            hashes[t] ^= keys[self.table[t][idx]]
+
+    '''
+    Returns the hash of the board in its identity orientation.
+    '''
+    def hash(self):
+        return self.hashes[0]
+
+    '''
+    Returns:
+        - (hash, t): the minimal hash over all 8 orientations and the
+          transform that maps this board onto its canonical orientation
+    '''
+    def canonical(self):
+        best = min(range(TRANSFORMS), key=self.hashes.__getitem__)
+        return self.hashes[best], best
+
+    '''
+    Returns the canonical (hash, t) of the board after playerID plays move,
+    without changing this object.
+    '''
+    def peek(self, move, playerID):
+        keys = self.keys[0 if playerID == 1 else 1]
+        idx = move[0] * self.BOARD_SIZE + move[1]
+        best_hash, best_t = None, 0
+        for t in range(TRANSFORMS):
+            h = self.hashes[t] ^ keys[self.table[t][idx]]
+            if best_hash is None or h < best_hash:
+                best_hash, best_t = h, t
+        return best_hash, best_t
+
+    '''
+    Maps a move on this board into the canonical orientation given by t.
+    '''
+    def toCanonical(self, move, t):
+        return transformMove(move, t, self.BOARD_SIZE)
+
+    '''
+    Maps a move stored against the canonical orientation back onto this board.
+    '''
+    def fromCanonical(self, move, t):
+        return transformMove(move, inverseTransform(t), self.BOARD_SIZE)
+
+'''
+Returns the canonical (hash, t) of a board, see SymmetricHash.canonical.
+'''
+def canonicalHash(board):
+    return SymmetricHash(board.shape[0], board).canonical()
+
+'''
+Filters a list of moves down to one representative per symmetry class of the
+resulting positions, keeping the first move of each class in list order.
+Parameters:
+    - board: the current state of the board
+    - moves: candidate moves for playerID
+    - playerID: the player making the moves
+Returns:
+    - the moves whose resulting positions are pairwise non-symmetric
+'''
+def uniqueMoves(board, moves, playerID):
+    hasher = SymmetricHash(board.shape[0], board)
+    seen = set()
+    unique = []
+    for move in moves:
+        key = hasher.peek(move, playerID)[0]
+        if key not in seen:
+            seen.add(key)
+            unique.append(move)
+    return unique